@@ -1,21 +1,76 @@
 # backend/app/main.py
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from collections import defaultdict, deque
+from typing import Deque, Dict
+import asyncio
 import datetime
-import uuid # For generating unique IDs if needed for interactions (though not part of schema yet)
+import json
 
 from .models.schemas import GenerateRequest, GenerateResponse, HistoryResponse
-from .services.ai_service import get_ai_responses
+from .services.ai_service import get_ai_responses, stream_ai_responses
+
+# Hoisted so the hot /generate path doesn't re-resolve the tzinfo attribute
+# on every request.
+UTC = datetime.timezone.utc
 
 # In-memory storage for demonstration (replace with DB later)
-# Each user_id maps to a list of their interactions (GenerateResponse like dicts)
-mock_db: Dict[str, List[Dict]] = {}
+# Struct-of-arrays layout: each user maps to four parallel bounded columns,
+# newest first (writes appendleft in timestamp order, so history reads need
+# no sorting and maxlen caps per-user memory growth). Building /history rows
+# zips the columns directly instead of doing per-row dict key lookups, and
+# same-field values sit contiguously for large histories.
+_HISTORY_MAXLEN = 1000
+
+def _new_user_columns() -> Dict[str, Deque]:
+    return {
+        "queries": deque(maxlen=_HISTORY_MAXLEN),
+        "casual": deque(maxlen=_HISTORY_MAXLEN),
+        "formal": deque(maxlen=_HISTORY_MAXLEN),
+        "ts": deque(maxlen=_HISTORY_MAXLEN),
+    }
+
+mock_db: Dict[str, Dict[str, Deque]] = defaultdict(_new_user_columns)
+
+# Sharded locks guarding mock_db mutation from concurrent /generate handlers.
+# Sharding by user_id hash keeps independent users from serializing on a
+# single global lock while still making each user's read-modify-write safe.
+_DB_LOCK_SHARDS = 16
+_db_locks = [asyncio.Lock() for _ in range(_DB_LOCK_SHARDS)]
+
+def _db_lock(user_id: str) -> asyncio.Lock:
+    return _db_locks[hash(user_id) % _DB_LOCK_SHARDS]
+
+# Per-user cache of the serialized /history JSON body. History only changes
+# on /generate, so repeated GETs (the Streamlit sidebar polls this) can skip
+# Pydantic serialization entirely. Invalidated on write; only populated for
+# users with stored history, so unknown user_ids can't grow it.
+_history_json_cache: Dict[str, bytes] = {}
+
+# Shared body for users with no stored history.
+_EMPTY_HISTORY_BODY = b'{"interactions":[]}'
+
+async def _store_interaction(user_id: str, query: str, casual_res: str, formal_res: str, timestamp: datetime.datetime):
+    """
+    Appends one interaction to the user's history columns (newest first)
+    and invalidates their cached /history body.
+    """
+    async with _db_lock(user_id):
+        columns = mock_db[user_id]
+        columns["queries"].appendleft(query)
+        columns["casual"].appendleft(casual_res)
+        columns["formal"].appendleft(formal_res)
+        columns["ts"].appendleft(timestamp)
+        _history_json_cache.pop(user_id, None)
 
 app = FastAPI(
     title="AI Prompt Engineering Service",
     description="API for generating AI responses and managing interaction history.",
-    version="0.1.0"
+    version="0.1.0",
+    # orjson serializes responses in Rust (datetimes natively) instead of
+    # stdlib json; noticeable on large /history payloads.
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -46,36 +101,15 @@ async def generate_ai_output(request: GenerateRequest):
         # Log the exception e
         raise HTTPException(status_code=500, detail=f"AI service failed: {str(e)}")
 
-    timestamp = datetime.datetime.now(datetime.timezone.utc)
-    
-    interaction_data = {
-        "query": request.query,
-        "casual_response": casual_res,
-        "formal_response": formal_res,
-        "timestamp": timestamp.isoformat() # Store as ISO string for consistency
-    }
+    timestamp = datetime.datetime.now(UTC)
 
-    # Store in our mock_db
-    if request.user_id not in mock_db:
-        mock_db[request.user_id] = []
-    
-    # We need to convert the interaction_data to a model that can be appended
-    # Or ensure mock_db stores objects that match GenerateResponse fields
-    # For simplicity, we'll store dicts and construct GenerateResponse for the return
-    
-    # Create a dictionary that can be easily converted back to GenerateResponse if needed
-    # Note: Pydantic models expect datetime objects, not ISO strings for datetime fields
-    # when creating an instance. So, we pass the `timestamp` object.
-    db_entry = {
-        "query": request.query,
-        "casual_response": casual_res,
-        "formal_response": formal_res,
-        "timestamp": timestamp # Store datetime object in mock_db for easier sorting
-    }
-    mock_db[request.user_id].append(db_entry)
-    
-    # Return a GenerateResponse model instance
-    return GenerateResponse(
+    await _store_interaction(request.user_id, request.query, casual_res, formal_res, timestamp)
+
+    # model_construct skips Pydantic validation entirely — every field here
+    # is data we just produced ourselves (validated request fields, AI output
+    # strings, a fresh datetime), so there is nothing to validate. Untrusted
+    # client input is still validated at the boundary via GenerateRequest.
+    return GenerateResponse.model_construct(
         query=request.query,
         casual_response=casual_res,
         formal_response=formal_res,
@@ -83,38 +117,81 @@ async def generate_ai_output(request: GenerateRequest):
     )
 
 
+@app.post("/generate/stream", tags=["AI Generation"])
+async def generate_ai_output_stream(request: GenerateRequest):
+    """
+    Streams casual and formal AI responses for a query as server-sent
+    events. Chunks arrive tagged `event: casual` or `event: formal` with a
+    JSON-encoded text fragment as data, followed by a final `event: done`.
+    The completed interaction is stored in history like /generate.
+    """
+    async def event_stream():
+        parts = {"casual": [], "formal": []}
+        async for style, chunk in stream_ai_responses(request.query):
+            parts[style].append(chunk)
+            # JSON-encode the fragment so newlines survive SSE line framing
+            yield f"event: {style}\ndata: {json.dumps(chunk)}\n\n"
+
+        # Store the completed interaction, same as the non-streaming path
+        await _store_interaction(
+            request.user_id,
+            request.query,
+            "".join(parts["casual"]),
+            "".join(parts["formal"]),
+            datetime.datetime.now(UTC)
+        )
+
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.get("/history", response_model=HistoryResponse, tags=["Interaction History"])
-async def get_user_history(user_id: str = Query(..., description="The ID of the user whose history is to be retrieved.")):
+async def get_user_history(request: Request, user_id: str = Query(..., description="The ID of the user whose history is to be retrieved.")):
     """
     Returns all past interactions for the given user in reverse chronological order.
     (Retrieves from in-memory store).
+
+    Sends a weak ETag derived from the history length and newest timestamp
+    and honors If-None-Match, so pollers re-downloading unchanged history
+    get a 304 with no body instead of the full payload.
     """
-    if user_id not in mock_db:
-        # Return an empty list of interactions if user_id not found
-        return HistoryResponse(interactions=[])
-
-    user_interactions_dicts = mock_db.get(user_id, [])
-    
-    # Sort interactions by timestamp in reverse chronological order (newest first)
-    # The timestamp is stored as a datetime object in mock_db
-    sorted_interactions = sorted(
-        user_interactions_dicts,
-        key=lambda x: x["timestamp"],
-        reverse=True
-    )
-    
-    # Convert list of dicts to list of GenerateResponse model instances
-    # FastAPI will automatically convert datetime to ISO string in the JSON response
-    interactions_models = [
-        GenerateResponse(
-            query=item["query"],
-            casual_response=item["casual_response"],
-            formal_response=item["formal_response"],
-            timestamp=item["timestamp"]
-        ) for item in sorted_interactions
-    ]
-    
-    return HistoryResponse(interactions=interactions_models)
+    columns = mock_db.get(user_id)
+    if columns and columns["ts"]:
+        etag = f'W/"{len(columns["ts"])}-{columns["ts"][0].timestamp()}"'
+    else:
+        etag = 'W/"0"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if columns is None:
+        # Unknown user: serve the shared constant body without touching the
+        # cache, so arbitrary unauthenticated user_id values can't grow
+        # _history_json_cache — the same hazard mock_db.get avoids above.
+        return Response(content=_EMPTY_HISTORY_BODY, media_type="application/json", headers=headers)
+
+    cached = _history_json_cache.get(user_id)
+    if cached is None:
+        # The columns are maintained newest-first by _store_interaction, so
+        # zipping them yields rows in reverse chronological order with no
+        # sorting and one column access per field instead of per-row dict
+        # lookups. model_construct skips validation: the columns only ever
+        # hold values we stored ourselves.
+        interactions = [
+            GenerateResponse.model_construct(
+                query=q, casual_response=c, formal_response=f, timestamp=t
+            )
+            for q, c, f, t in zip(columns["queries"], columns["casual"], columns["formal"], columns["ts"])
+        ]
+        history = HistoryResponse.model_construct(interactions=interactions)
+        cached = history.model_dump_json().encode()
+        _history_json_cache[user_id] = cached
+
+    # Returning a Response directly bypasses FastAPI's response_model
+    # serialization, so cache hits cost zero pydantic-core work.
+    return Response(content=cached, media_type="application/json", headers=headers)
 
 @app.get("/", tags=["Root"])
 async def read_root():
@@ -135,5 +212,9 @@ async def read_root():
 if __name__ == "__main__":
     # This part is for running with `python app/main.py` for simple testing,
     # but `uvicorn app.main:app --reload` is preferred for development.
+    # uvloop (libuv event loop) and httptools (C HTTP parser) replace the
+    # default asyncio loop and h11 parser, cutting per-request overhead on
+    # the many small /history and streaming calls; both ship with
+    # uvicorn[standard], which is already in requirements.
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
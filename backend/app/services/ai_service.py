@@ -1,6 +1,12 @@
 # backend/app/services/ai_service.py
+import asyncio
 import google.generativeai as genai
+import hashlib
+import json
 import os
+import re
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 import logging
 
@@ -27,6 +33,9 @@ if not GEMINI_API_KEY:
     # raise ValueError("GOOGLE_API_KEY not found. Please set it in your .env file.")
 else:
     try:
+        # genai.configure is synchronous, but it only runs here at import —
+        # never on the request path, so it can't stall the event loop. If a
+        # runtime config reload is ever added, wrap it in asyncio.to_thread.
         genai.configure(api_key=GEMINI_API_KEY)
     except Exception as e:
         logger.error(f"Error configuring Gemini API: {e}")
@@ -41,22 +50,113 @@ except Exception as e:
     logger.error(f"Error initializing Gemini Model: {e}. Ensure the API key is valid and the model name is correct.")
     model = None # Set model to None if initialization fails
 
-async def generate_text_gemini(prompt: str) -> str:
+# Availability is constant after import, so fold the model and API-key
+# checks into one precomputed flag with a matching error message. The hot
+# path then does a single global lookup and truthiness test per call.
+_AI_AVAILABLE = bool(model and GEMINI_API_KEY)
+_AI_UNAVAILABLE_MSG = (
+    "Error: AI model not available." if not model else "Error: API key not configured."
+)
+
+# Ask Gemini for JSON directly when the installed SDK supports it;
+# older SDK versions fall back to plain text plus regex extraction below.
+try:
+    _JSON_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json")
+except (AttributeError, TypeError):
+    _JSON_GENERATION_CONFIG = None
+
+# In-process cache for Gemini responses. Identical prompts (retries, demo
+# traffic, history refreshes) hit a dict instead of a paid, seconds-long
+# remote call. Entries expire lazily after a TTL and the cache is capped,
+# evicting least-recently-used entries first.
+_CACHE_MAX_ENTRIES = 1024
+_CACHE_TTL_SECONDS = 300
+_response_cache: OrderedDict[bytes, tuple[float, str]] = OrderedDict()
+# Single-flight map coalescing concurrent duplicate requests: the first
+# caller for a prompt starts the API call and registers a Future; later
+# callers await that Future instead of issuing their own call.
+_inflight: dict[bytes, asyncio.Future] = {}
+
+def _cache_key(prompt: str) -> bytes:
+    return hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+
+def _cache_get(key: bytes) -> str | None:
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    ts, value = entry
+    if time.monotonic() - ts > _CACHE_TTL_SECONDS:
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return value
+
+def _cache_put(key: bytes, value: str) -> None:
+    _response_cache[key] = (time.monotonic(), value)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > _CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+async def generate_text_gemini(prompt: str, generation_config=None, cache_key: bytes | None = None) -> str:
     """
     Generates text using the Google Gemini API.
+
+    Responses for identical prompts are served from an in-process LRU cache
+    with a TTL; concurrent requests for the same prompt are coalesced into
+    one upstream call. Error responses are never cached. Callers that build
+    prompts from the module templates pass a precomputed cache_key so the
+    constant template bytes aren't re-hashed per call.
     """
-    if not model:
-        logger.error("Gemini model not initialized. Cannot generate text.")
-        return "Error: AI model not available."
-    if not GEMINI_API_KEY:
-        logger.error("Gemini API Key not configured. Cannot generate text.")
-        return "Error: API key not configured."
+    key = cache_key if cache_key is not None else _cache_key(prompt)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    # Single-flight: if an identical prompt is already in flight, await its
+    # result. shield keeps a cancelled waiter (e.g. a gather timeout) from
+    # cancelling the Future out from under the caller that owns the call.
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _generate_text_gemini_uncached(prompt, generation_config)
+        if not result.startswith(("Error:", "Content generation failed")):
+            _cache_put(key, result)
+        if not future.done():
+            future.set_result(result)
+        return result
+    except BaseException as e:
+        if not future.done():
+            future.set_exception(e)
+            # Waiters retrieve it; stop the event loop logging it as unretrieved
+            future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+async def _generate_text_gemini_uncached(prompt: str, generation_config=None) -> str:
+    """
+    Performs the actual Gemini API call, without caching.
+
+    generate_content_async is genuinely non-blocking (grpc.aio under the
+    hood), so awaiting it never stalls the event loop; no to_thread
+    offloading is needed anywhere on this path.
+    """
+    if not _AI_AVAILABLE:
+        logger.error("Gemini model or API key not configured. Cannot generate text.")
+        return _AI_UNAVAILABLE_MSG
 
     try:
         # For gemini-1.5-flash, the structure for sending content is slightly different
         # from older models if you were using `generate_content` directly with a simple string.
         # The model expects a list of parts.
-        response = await model.generate_content_async(prompt) # Use async version
+        if generation_config is not None:
+            response = await model.generate_content_async(prompt, generation_config=generation_config)
+        else:
+            response = await model.generate_content_async(prompt) # Use async version
         
         # Check for safety ratings and blocked prompts if necessary
         if response.prompt_feedback and response.prompt_feedback.block_reason:
@@ -84,29 +184,213 @@ async def generate_text_gemini(prompt: str) -> str:
         return f"Error: AI service request failed. Details: {str(e)}"
 
 
+def _parse_batched_response(text: str) -> tuple[str, str] | None:
+    """
+    Extracts the casual/formal pair from a batched Gemini response.
+    Returns None if the text doesn't contain valid JSON with both keys.
+    """
+    match = re.search(r'\{.*\}', text, re.S)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    casual = data.get("casual")
+    formal = data.get("formal")
+    if not isinstance(casual, str) or not isinstance(formal, str):
+        return None
+    return casual, formal
+
+
 async def get_ai_responses(user_query: str) -> tuple[str, str]:
     """
     Generates a casual and a formal response for a given user query.
+
+    Both styles are requested in a single batched Gemini call that returns
+    JSON, halving round trips versus one request per style. If the batched
+    response can't be parsed, falls back to the two-call path.
     """
-    casual_prompt = f"""
+    batched_prompt = _BATCHED_PREFIX + user_query + _BATCHED_SUFFIX
+
+    raw = await generate_text_gemini(
+        batched_prompt,
+        generation_config=_JSON_GENERATION_CONFIG,
+        cache_key=_template_cache_key(_BATCHED_HASH_BASE, user_query, _BATCHED_SUFFIX_BYTES)
+    )
+    if not raw.startswith("Error:"):
+        parsed = _parse_batched_response(raw)
+        if parsed is not None:
+            return parsed
+        logger.warning("Batched Gemini response was not valid JSON; falling back to two calls.")
+
+    return await _get_ai_responses_two_calls(user_query)
+
+
+# Prompt templates are built once at import. Only the query varies, so each
+# prompt is assembled with two concatenations instead of re-interpolating a
+# ~500-byte multi-line f-string per call.
+_BATCHED_PREFIX = """
+    You are an AI assistant that answers in two distinct styles.
+    A user asked: \""""
+_BATCHED_SUFFIX = """\"
+
+    Respond with a strict JSON object containing exactly two string keys:
+    - "casual": a casual, easy-to-understand, and creative explanation,
+      as if talking to a curious friend. Use analogies if they help.
+      Keep it concise but informative.
+    - "formal": a formal, structured, and analytical explanation focused
+      on key concepts, definitions, and implications, using precise
+      language suitable for an academic or professional audience.
+
+    Return only the JSON object, with no surrounding text or markdown.
+    """
+
+_CASUAL_PREFIX = """
     You are a friendly and engaging AI assistant.
-    A user asked: "{user_query}"
+    A user asked: \""""
+_CASUAL_SUFFIX = """\"
     Please explain this to them in a casual, easy-to-understand, and creative way.
     Imagine you're talking to a curious friend. Use analogies if they help!
     Keep it concise but informative.
     """
 
-    formal_prompt = f"""
+_FORMAL_PREFIX = """
     You are a precise and analytical AI assistant.
-    Regarding the query: "{user_query}"
+    Regarding the query: \""""
+_FORMAL_SUFFIX = """\"
     Provide a formal, structured, and analytical explanation.
     Focus on key concepts, definitions, and implications.
     Use precise language suitable for an academic or professional audience.
     Ensure the information is accurate and well-organized.
     """
 
-    casual_response = await generate_text_gemini(casual_prompt)
-    formal_response = await generate_text_gemini(formal_prompt)
+def _casual_prompt(user_query: str) -> str:
+    return _CASUAL_PREFIX + user_query + _CASUAL_SUFFIX
+
+def _formal_prompt(user_query: str) -> str:
+    return _FORMAL_PREFIX + user_query + _FORMAL_SUFFIX
+
+# Cache keys for templated prompts are hashed incrementally: a blake2b state
+# pre-seeded with the (large, constant) prefix is copied per call and updated
+# with just the query and the pre-encoded suffix bytes. The digest is
+# identical to hashing the full prompt, but only the variable part is
+# encoded and hashed per call.
+_BATCHED_HASH_BASE = hashlib.blake2b(_BATCHED_PREFIX.encode(), digest_size=16)
+_BATCHED_SUFFIX_BYTES = _BATCHED_SUFFIX.encode()
+_CASUAL_HASH_BASE = hashlib.blake2b(_CASUAL_PREFIX.encode(), digest_size=16)
+_CASUAL_SUFFIX_BYTES = _CASUAL_SUFFIX.encode()
+_FORMAL_HASH_BASE = hashlib.blake2b(_FORMAL_PREFIX.encode(), digest_size=16)
+_FORMAL_SUFFIX_BYTES = _FORMAL_SUFFIX.encode()
+
+def _template_cache_key(base, user_query: str, suffix_bytes: bytes) -> bytes:
+    h = base.copy()
+    h.update(user_query.encode())
+    h.update(suffix_bytes)
+    return h.digest()
+
+
+async def stream_text_gemini(prompt: str):
+    """
+    Streams text from the Google Gemini API, yielding fragments as they
+    arrive. Errors are yielded as a single error string, mirroring
+    generate_text_gemini's fallback behaviour.
+    """
+    if not _AI_AVAILABLE:
+        logger.error("Gemini model or API key not configured. Cannot generate text.")
+        yield _AI_UNAVAILABLE_MSG
+        return
+
+    try:
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except (ValueError, AttributeError):
+                # Chunks without text (e.g. safety-blocked) are skipped
+                continue
+            if text:
+                yield text
+    except Exception as e:
+        logger.error(f"Error during streaming Gemini API call: {e}")
+        yield f"Error: AI service request failed. Details: {str(e)}"
+
+
+async def stream_ai_responses(user_query: str):
+    """
+    Streams the casual and formal responses for a query concurrently,
+    yielding ("casual" | "formal", text_chunk) tuples in arrival order.
+    Time-to-first-token is a fraction of waiting for the full responses.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def _pump(style: str, prompt: str):
+        try:
+            async for chunk in stream_text_gemini(prompt):
+                await queue.put((style, chunk))
+        finally:
+            # None marks this style's stream as finished
+            await queue.put((style, None))
+
+    tasks = [
+        asyncio.create_task(_pump("casual", _casual_prompt(user_query))),
+        asyncio.create_task(_pump("formal", _formal_prompt(user_query))),
+    ]
+    finished = 0
+    try:
+        while finished < len(tasks):
+            style, chunk = await queue.get()
+            if chunk is None:
+                finished += 1
+                continue
+            yield style, chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _get_ai_responses_two_calls(user_query: str) -> tuple[str, str]:
+    """
+    Fallback path: generates the casual and formal responses with one
+    Gemini call per style.
+    """
+    casual_prompt = _casual_prompt(user_query)
+    formal_prompt = _formal_prompt(user_query)
+
+    # Fire both requests concurrently; the calls are I/O-bound, so overlapping
+    # them roughly halves the wall-clock latency of a /generate call.
+    # Each side gets its own timeout so one slow request can't hang the other,
+    # and return_exceptions=True keeps a failure on one side from discarding
+    # the other side's result.
+    casual_response, formal_response = await asyncio.gather(
+        asyncio.wait_for(
+            generate_text_gemini(
+                casual_prompt,
+                cache_key=_template_cache_key(_CASUAL_HASH_BASE, user_query, _CASUAL_SUFFIX_BYTES)
+            ),
+            timeout=60
+        ),
+        asyncio.wait_for(
+            generate_text_gemini(
+                formal_prompt,
+                cache_key=_template_cache_key(_FORMAL_HASH_BASE, user_query, _FORMAL_SUFFIX_BYTES)
+            ),
+            timeout=60
+        ),
+        return_exceptions=True
+    )
+
+    # BaseException, not Exception: a cancelled single-flight owner propagates
+    # CancelledError to coalesced waiters, and gather captures it into the
+    # results — it must become an error string, never a stored "response".
+    # str() of e.g. TimeoutError() is empty, so fall back to repr for a
+    # readable message.
+    if isinstance(casual_response, BaseException):
+        logger.error(f"Casual response generation failed: {casual_response!r}")
+        casual_response = f"Error: AI service request failed. Details: {str(casual_response) or repr(casual_response)}"
+    if isinstance(formal_response, BaseException):
+        logger.error(f"Formal response generation failed: {formal_response!r}")
+        formal_response = f"Error: AI service request failed. Details: {str(formal_response) or repr(formal_response)}"
 
     return casual_response, formal_response
 
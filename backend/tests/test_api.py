@@ -4,18 +4,20 @@ from fastapi.testclient import TestClient
 # Adjust the import path based on how you run pytest
 # If running pytest from the project root: from backend.app.main import app
 # If running pytest from the backend directory: from app.main import app
-from ..app.main import app # Assuming pytest is run from the 'backend' directory
+from app.main import app # Assuming pytest is run from the 'backend' directory
 
 client = TestClient(app)
 
 # Fixture to clear mock_db before each test that modifies it
 @pytest.fixture(autouse=True)
 def clear_mock_db_around_tests():
-    from ..app.main import mock_db # import locally to modify
+    from app.main import mock_db, _history_json_cache # import locally to modify
     original_db_content = mock_db.copy()
     mock_db.clear()
+    _history_json_cache.clear()
     yield
     mock_db.clear()
+    _history_json_cache.clear()
     mock_db.update(original_db_content)
 
 
@@ -30,8 +32,8 @@ def test_read_root():
 def test_generate_ai_output_success(mocker):
     # Mock the AI service to avoid actual API calls during testing
     mocker.patch(
-        # 'backend.app.services.ai_service.get_ai_responses', # If running from root
-        'app.services.ai_service.get_ai_responses', # If running from backend/
+        # main.py imports the name directly, so patch the reference it uses
+        'app.main.get_ai_responses',
         return_value=("Casual test response", "Formal test response")
     )
 
@@ -47,15 +49,16 @@ def test_generate_ai_output_success(mocker):
     assert "timestamp" in data
 
     # Check if data is in mock_db (imported from app.main)
-    from ..app.main import mock_db
+    from app.main import mock_db
     assert user_id in mock_db
-    assert len(mock_db[user_id]) == 1
-    assert mock_db[user_id][0]["query"] == query
+    # Entries are stored as parallel columns, newest first
+    assert len(mock_db[user_id]["queries"]) == 1
+    assert mock_db[user_id]["queries"][0] == query
 
 
 def test_generate_ai_output_ai_failure(mocker):
     mocker.patch(
-        'app.services.ai_service.get_ai_responses',
+        'app.main.get_ai_responses',
         side_effect=Exception("AI service unavailable")
     )
     response = client.post("/generate", json={"user_id": "testuser_fail", "query": "Test query"})
@@ -63,10 +66,35 @@ def test_generate_ai_output_ai_failure(mocker):
     assert "AI service failed: AI service unavailable" in response.json()["detail"]
 
 
+def test_generate_stream_sse(mocker):
+    # Fake the merged service stream; chunks interleave across styles
+    async def fake_stream(query):
+        yield "casual", "Hello "
+        yield "formal", "Greetings."
+        yield "casual", "there!"
+
+    mocker.patch('app.main.stream_ai_responses', fake_stream)
+
+    user_id = "stream_user"
+    response = client.post("/generate/stream", json={"user_id": user_id, "query": "Stream test"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    body = response.text
+    assert 'event: casual\ndata: "Hello "' in body
+    assert 'event: formal\ndata: "Greetings."' in body
+    assert "event: done" in body
+
+    # The completed interaction is stored in history like /generate
+    from app.main import mock_db
+    assert mock_db[user_id]["casual"][0] == "Hello there!"
+    assert mock_db[user_id]["formal"][0] == "Greetings."
+
+
 def test_get_user_history_found(mocker):
     # Mock AI service for populating history
     mocker.patch(
-        'app.services.ai_service.get_ai_responses',
+        'app.main.get_ai_responses',
         return_value=("Casual hist", "Formal hist")
     )
 
@@ -83,12 +111,41 @@ def test_get_user_history_found(mocker):
     assert data["interactions"][0]["query"] == "Query 2" # Newest first
     assert data["interactions"][1]["query"] == "Query 1"
 
+def test_get_user_history_etag_not_modified(mocker):
+    mocker.patch(
+        'app.main.get_ai_responses',
+        return_value=("Casual hist", "Formal hist")
+    )
+
+    user_id = "etag_user"
+    client.post("/generate", json={"user_id": user_id, "query": "Query 1"})
+
+    first = client.get(f"/history?user_id={user_id}")
+    assert first.status_code == 200
+    etag = first.headers.get("etag")
+    assert etag
+
+    # Unchanged history revalidates to a bodyless 304
+    second = client.get(f"/history?user_id={user_id}", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+
+    # A new interaction changes the ETag, so the conditional GET misses
+    client.post("/generate", json={"user_id": user_id, "query": "Query 2"})
+    third = client.get(f"/history?user_id={user_id}", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert third.headers.get("etag") != etag
+    assert len(third.json()["interactions"]) == 2
+
 def test_get_user_history_not_found():
     response = client.get("/history?user_id=nonexistentuser")
     assert response.status_code == 200 # API returns 200 with empty list as per spec
     data = response.json()
     assert data["interactions"] == []
 
+    # Unknown user_ids must not grow the serialized-body cache
+    from app.main import _history_json_cache
+    assert "nonexistentuser" not in _history_json_cache
+
 def test_get_user_history_no_userid():
     response = client.get("/history") # Missing user_id query parameter
     assert response.status_code == 422 # FastAPI validation error for missing required query param
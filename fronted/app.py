@@ -2,6 +2,7 @@
 import streamlit as st
 import requests
 import datetime
+import json
 import os
 
 # --- Configuration ---
@@ -9,14 +10,25 @@ import os
 # For local development, assuming backend runs on port 8000
 BACKEND_API_URL = os.getenv("BACKEND_API_URL", "http://127.0.0.1:8000")
 GENERATE_ENDPOINT = f"{BACKEND_API_URL}/generate"
+STREAM_ENDPOINT = f"{BACKEND_API_URL}/generate/stream"
 HISTORY_ENDPOINT = f"{BACKEND_API_URL}/history"
 
 # --- Helper Functions ---
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    Returns a shared requests.Session with connection pooling.
+    Streamlit re-runs this script on every interaction; caching the session
+    keeps the TCP/TLS connection to the backend alive across reruns instead
+    of paying a fresh handshake per call.
+    """
+    return requests.Session()
+
 def generate_responses(user_id: str, query: str):
     """Sends request to backend to generate AI responses."""
     payload = {"user_id": user_id, "query": query}
     try:
-        response = requests.post(GENERATE_ENDPOINT, json=payload, timeout=120) # Increased timeout
+        response = get_http_session().post(GENERATE_ENDPOINT, json=payload, timeout=120) # Increased timeout
         response.raise_for_status()  # Raises an exception for HTTP errors (4XX, 5XX)
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -26,15 +38,78 @@ def generate_responses(user_id: str, query: str):
         st.error(f"An unexpected error occurred: {e}")
         return None
 
+def stream_responses(user_id: str, query: str, casual_placeholder, formal_placeholder):
+    """
+    Streams AI responses from the backend's SSE endpoint, updating the two
+    placeholders as chunks arrive. Returns the full (casual, formal) texts,
+    or None on error.
+    """
+    payload = {"user_id": user_id, "query": query}
+    parts = {"casual": [], "formal": []}
+    try:
+        with get_http_session().post(STREAM_ENDPOINT, json=payload, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue  # blank line ends an SSE event block
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event in parts:
+                    # Chunks are JSON-encoded strings so newlines survive SSE framing
+                    parts[event].append(json.loads(line[len("data: "):]))
+                    if event == "casual":
+                        casual_placeholder.info("".join(parts["casual"]))
+                    else:
+                        formal_placeholder.warning("".join(parts["formal"]))
+        return "".join(parts["casual"]), "".join(parts["formal"])
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error connecting to backend: {e}")
+        return None
+    except Exception as e:
+        st.error(f"An unexpected error occurred: {e}")
+        return None
+
+@st.cache_data(show_spinner=False)
+def format_timestamp(ts: str) -> tuple:
+    """
+    Parses an ISO-8601 timestamp once and returns (short, long) display
+    strings. Cached because Streamlit re-runs the whole script on every
+    interaction and history entries never change — without this the
+    sidebar re-parses every timestamp twice per rerun.
+    """
+    if not ts:
+        return "N/A", "N/A"
+    try:
+        # Handle potential 'Z' suffix for UTC
+        dt_obj = datetime.datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    except ValueError:
+        return ts, f"{ts} (could not parse)"
+    return dt_obj.strftime('%Y-%m-%d %H:%M'), dt_obj.strftime('%Y-%m-%d %H:%M:%S %Z')
+
 def get_history(user_id: str):
-    """Fetches interaction history for a user from the backend."""
+    """
+    Fetches interaction history for a user from the backend.
+    Uses a conditional GET: the last ETag and payload are kept in
+    st.session_state, so when history hasn't changed the backend answers
+    304 with no body instead of re-sending the full payload on every rerun.
+    """
     params = {"user_id": user_id}
+    cache = st.session_state.setdefault("history_cache", {})
+    etag, cached_interactions = cache.get(user_id, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
     try:
-        response = requests.get(HISTORY_ENDPOINT, params=params, timeout=30)
+        response = get_http_session().get(HISTORY_ENDPOINT, params=params, headers=headers, timeout=30)
+        if response.status_code == 304 and cached_interactions is not None:
+            return cached_interactions
         response.raise_for_status()
         data = response.json()
         # Ensure interactions are present and are a list
-        return data.get("interactions", []) if isinstance(data.get("interactions"), list) else []
+        interactions = data.get("interactions", []) if isinstance(data.get("interactions"), list) else []
+        new_etag = response.headers.get("ETag")
+        if new_etag:
+            cache[user_id] = (new_etag, interactions)
+        return interactions
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching history: {e}")
         return []
@@ -63,6 +138,9 @@ if new_user_id != st.session_state.user_id:
 
 st.sidebar.info(f"Current User ID: **{st.session_state.user_id}**")
 
+# Streaming shows tokens as they arrive instead of waiting for the full responses
+stream_enabled = st.sidebar.checkbox("Stream responses", value=True)
+
 
 # --- Main Interaction Area ---
 st.header("📝 Your Query")
@@ -71,9 +149,36 @@ with st.form("query_form"):
     user_query = st.text_area("Enter your question or topic:", height=100, key="user_query_input")
     submit_button = st.form_submit_button("🚀 Generate Responses")
 
+streamed_this_run = False
+
 if submit_button and user_query:
     if not st.session_state.user_id:
         st.warning("Please enter a User ID in the sidebar.")
+    elif stream_enabled:
+        # Render placeholders up front and fill them as chunks arrive;
+        # time-to-first-token is much lower than waiting for the full responses.
+        st.subheader(f"🔍 Responses for: \"{user_query}\"")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("### 😊 Casual Response")
+            casual_placeholder = st.empty()
+        with col2:
+            st.markdown("### 🧐 Formal Response")
+            formal_placeholder = st.empty()
+
+        result = stream_responses(st.session_state.user_id, user_query, casual_placeholder, formal_placeholder)
+        if result:
+            casual_text, formal_text = result
+            st.session_state.last_response = {
+                "query": user_query,
+                "casual_response": casual_text,
+                "formal_response": formal_text,
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }
+            streamed_this_run = True  # content already on screen; skip re-render below
+        else:
+            st.error("Failed to get responses from the AI. Please check backend logs or try again.")
+            st.session_state.last_response = None
     else:
         with st.spinner("🧠 Thinking... Please wait, this might take a moment..."):
             api_response = generate_responses(st.session_state.user_id, user_query)
@@ -87,7 +192,7 @@ if submit_button and user_query:
             st.session_state.last_response = None # Clear previous if error
 
 # Display last responses if available
-if 'last_response' in st.session_state and st.session_state.last_response:
+if not streamed_this_run and 'last_response' in st.session_state and st.session_state.last_response:
     response_data = st.session_state.last_response
     st.subheader(f"🔍 Responses for: \"{response_data.get('query', 'Your Query')}\"")
     
@@ -115,20 +220,15 @@ if st.session_state.user_id:
     if history_interactions:
         st.sidebar.markdown(f"Showing history for **{st.session_state.user_id}**:")
         for i, item in enumerate(history_interactions): # Already sorted newest first by backend
-            with st.sidebar.expander(f"{item.get('query', 'Unknown Query')[:30]}... ({datetime.datetime.fromisoformat(item.get('timestamp')).strftime('%Y-%m-%d %H:%M') if item.get('timestamp') else 'N/A'})"):
+            ts_short, ts_long = format_timestamp(item.get('timestamp'))
+            with st.sidebar.expander(f"{item.get('query', 'Unknown Query')[:30]}... ({ts_short})"):
                 st.markdown(f"**Query:** {item.get('query')}")
                 st.markdown("**Casual Response:**")
                 st.caption(item.get('casual_response'))
                 st.markdown("**Formal Response:**")
                 st.caption(item.get('formal_response'))
-                ts = item.get('timestamp')
-                if ts:
-                    try:
-                        # Ensure timestamp is parsed correctly, handling potential 'Z' for UTC
-                        dt_obj = datetime.datetime.fromisoformat(ts.replace('Z', '+00:00'))
-                        st.markdown(f"<small>Timestamp: {dt_obj.strftime('%Y-%m-%d %H:%M:%S %Z')}</small>", unsafe_allow_html=True)
-                    except ValueError:
-                        st.markdown(f"<small>Timestamp: {ts} (could not parse)</small>", unsafe_allow_html=True)
+                if item.get('timestamp'):
+                    st.markdown(f"<small>Timestamp: {ts_long}</small>", unsafe_allow_html=True)
 
     else:
         st.sidebar.info("No history found for this user or unable to fetch.")